@@ -12,6 +12,8 @@ import torch.utils.data
 import torch.nn as nn
 import torch.nn.functional as F
 
+from utils.miscellaneous.mixed_precision import MixedPrecision
+
 
 def train_cl_clf(device: torch.device,
 
@@ -21,7 +23,8 @@ def train_cl_clf(device: torch.device,
                  data_loader: torch.utils.data.DataLoader,
 
                  max_num_batches: int,
-                 optimizer: torch.optim, ):
+                 optimizer: torch.optim,
+                 amp: MixedPrecision, ):
 
     category_clf_net.train()
     site_clf_net.train()
@@ -34,22 +37,29 @@ def train_cl_clf(device: torch.device,
             break
 
         rnaseq, data_src, cl_site, cl_type, cl_category = \
-            rnaseq.to(device), data_src.to(device), cl_site.to(device), \
-            cl_type.to(device), cl_category.to(device)
+            rnaseq.to(device, non_blocking=True), \
+            data_src.to(device, non_blocking=True), \
+            cl_site.to(device, non_blocking=True), \
+            cl_type.to(device, non_blocking=True), \
+            cl_category.to(device, non_blocking=True)
 
         category_clf_net.zero_grad()
         site_clf_net.zero_grad()
         type_clf_net.zero_grad()
 
-        out_category = category_clf_net(rnaseq, data_src)
-        out_site = site_clf_net(rnaseq, data_src)
-        out_type = type_clf_net(rnaseq, data_src)
+        with amp.autocast():
+            out_category = category_clf_net(rnaseq, data_src)
+            out_site = site_clf_net(rnaseq, data_src)
+            out_type = type_clf_net(rnaseq, data_src)
 
-        F.nll_loss(input=out_category, target=cl_category).backward()
-        F.nll_loss(input=out_site, target=cl_site).backward()
-        F.nll_loss(input=out_type, target=cl_type).backward()
+            # Summing up the losses yields the same gradients as three
+            # separate backward passes, with a single autograd call
+            loss = F.nll_loss(input=out_category, target=cl_category) + \
+                F.nll_loss(input=out_site, target=cl_site) + \
+                F.nll_loss(input=out_type, target=cl_type)
 
-        optimizer.step()
+        amp.backward(loss)
+        amp.step(optimizer)
 
 
 def valid_cl_clf(
@@ -58,7 +68,9 @@ def valid_cl_clf(
         category_clf_net: nn.Module,
         site_clf_net: nn.Module,
         type_clf_net: nn.Module,
-        data_loader: torch.utils.data.DataLoader, ):
+        data_loader: torch.utils.data.DataLoader,
+        amp: MixedPrecision,
+        dtype: torch.dtype = torch.float32, ):
 
     category_clf_net.eval()
     site_clf_net.eval()
@@ -72,28 +84,32 @@ def valid_cl_clf(
         for rnaseq, data_src, cl_site, cl_type, cl_category in data_loader:
 
             rnaseq, data_src, cl_site, cl_type, cl_category = \
-                rnaseq.to(device), data_src.to(device), cl_site.to(device), \
-                cl_type.to(device), cl_category.to(device)
+                rnaseq.to(device, dtype, non_blocking=True), \
+                data_src.to(device, dtype, non_blocking=True), \
+                cl_site.to(device, non_blocking=True), \
+                cl_type.to(device, non_blocking=True), \
+                cl_category.to(device, non_blocking=True)
 
-            out_category = category_clf_net(rnaseq, data_src)
-            out_site = site_clf_net(rnaseq, data_src)
-            out_type = type_clf_net(rnaseq, data_src)
+            with amp.autocast(dtype):
+                out_category = category_clf_net(rnaseq, data_src)
+                out_site = site_clf_net(rnaseq, data_src)
+                out_type = type_clf_net(rnaseq, data_src)
 
             pred_category = out_category.max(1, keepdim=True)[1]
             pred_site = out_site.max(1, keepdim=True)[1]
             pred_type = out_type.max(1, keepdim=True)[1]
 
             correct_category += pred_category.eq(
-                cl_category.view_as(pred_category)).sum().item()
+                cl_category.view_as(pred_category)).sum()
             correct_site += pred_site.eq(
-                cl_site.view_as(pred_site)).sum().item()
+                cl_site.view_as(pred_site)).sum()
             correct_type += pred_type.eq(
-                cl_type.view_as(pred_type)).sum().item()
+                cl_type.view_as(pred_type)).sum()
 
     # Get overall accuracy
-    category_acc = 100. * correct_category / len(data_loader.dataset)
-    site_acc = 100. * correct_site / len(data_loader.dataset)
-    type_acc = 100. * correct_type / len(data_loader.dataset)
+    category_acc = 100. * float(correct_category) / len(data_loader.dataset)
+    site_acc = 100. * float(correct_site) / len(data_loader.dataset)
+    type_acc = 100. * float(correct_type) / len(data_loader.dataset)
 
     print('\tCell Line Classification: '
           '\n\t\tCategory Accuracy: \t\t%5.2f%%; '
@@ -14,6 +14,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 from sklearn.metrics import r2_score
 
+from utils.miscellaneous.mixed_precision import MixedPrecision
+
 
 def train_drug_qed(device: torch.device,
 
@@ -22,7 +24,8 @@ def train_drug_qed(device: torch.device,
 
                    max_num_batches: int,
                    loss_func: callable,
-                   optimizer: torch.optim, ):
+                   optimizer: torch.optim,
+                   amp: MixedPrecision, ):
 
     drug_qed_net.train()
     total_loss = 0.
@@ -33,28 +36,31 @@ def train_drug_qed(device: torch.device,
         if batch_idx >= max_num_batches:
             break
 
-        drug_feature, target = drug_feature.to(device), target.to(device)
+        drug_feature, target = drug_feature.to(device, non_blocking=True), \
+            target.to(device, non_blocking=True)
 
         drug_qed_net.zero_grad()
-        pred_target = drug_qed_net(drug_feature)
-
-        loss = loss_func(pred_target, target)
+        with amp.autocast():
+            pred_target = drug_qed_net(drug_feature)
+            loss = loss_func(pred_target, target)
 
-        loss.backward()
-        optimizer.step()
+        amp.backward(loss)
+        amp.step(optimizer)
 
         num_samples += target.shape[0]
-        total_loss += loss.item() * target.shape[0]
+        total_loss += loss.detach().double() * target.shape[0]
 
     print('\tDrug Weighted QED Regression Loss: %8.6f'
-          % (total_loss / num_samples))
+          % (float(total_loss) / num_samples))
 
 
 def valid_drug_qed(device: torch.device,
 
                    drug_qed_net: nn.Module,
 
-                   data_loader: torch.utils.data.DataLoader, ):
+                   data_loader: torch.utils.data.DataLoader,
+                   amp: MixedPrecision,
+                   dtype: torch.dtype = torch.float32, ):
 
     drug_qed_net.eval()
     mse, mae = 0., 0.
@@ -63,9 +69,13 @@ def valid_drug_qed(device: torch.device,
     with torch.no_grad():
         for drug_feature, target in data_loader:
 
-            drug_feature, target = drug_feature.to(device), target.to(device)
+            drug_feature, target = \
+                drug_feature.to(device, dtype, non_blocking=True), \
+                target.to(device, non_blocking=True)
 
-            pred_target = drug_qed_net(drug_feature)
+            with amp.autocast(dtype):
+                pred_target = drug_qed_net(drug_feature)
+            pred_target = pred_target.float()
 
             num_samples = target.shape[0]
             mse += F.mse_loss(pred_target, target).item() * num_samples
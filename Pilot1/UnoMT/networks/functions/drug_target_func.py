@@ -12,6 +12,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from utils.miscellaneous.mixed_precision import MixedPrecision
+
 
 def train_drug_target(device: torch.device,
 
@@ -19,7 +21,8 @@ def train_drug_target(device: torch.device,
                       data_loader: torch.utils.data.DataLoader,
 
                       max_num_batches: int,
-                      optimizer: torch.optim, ):
+                      optimizer: torch.optim,
+                      amp: MixedPrecision, ):
 
     drug_target_net.train()
 
@@ -28,18 +31,23 @@ def train_drug_target(device: torch.device,
         if batch_idx >= max_num_batches:
             break
 
-        drug_feature, target = drug_feature.to(device), target.to(device)
+        drug_feature, target = drug_feature.to(device, non_blocking=True), \
+            target.to(device, non_blocking=True)
 
         drug_target_net.zero_grad()
-        out_target = drug_target_net(drug_feature)
-        F.nll_loss(input=out_target, target=target).backward()
-        optimizer.step()
+        with amp.autocast():
+            out_target = drug_target_net(drug_feature)
+            loss = F.nll_loss(input=out_target, target=target)
+        amp.backward(loss)
+        amp.step(optimizer)
 
 
 def valid_drug_target(device: torch.device,
 
                       drug_target_net: nn.Module,
-                      data_loader: torch.utils.data.DataLoader, ):
+                      data_loader: torch.utils.data.DataLoader,
+                      amp: MixedPrecision,
+                      dtype: torch.dtype = torch.float32, ):
 
     drug_target_net.eval()
 
@@ -48,16 +56,19 @@ def valid_drug_target(device: torch.device,
     with torch.no_grad():
         for drug_feature, target in data_loader:
 
-            drug_feature, target = drug_feature.to(device), target.to(device)
+            drug_feature, target = \
+                drug_feature.to(device, dtype, non_blocking=True), \
+                target.to(device, non_blocking=True)
 
-            out_target = drug_target_net(drug_feature)
+            with amp.autocast(dtype):
+                out_target = drug_target_net(drug_feature)
             pred_target = out_target.max(1, keepdim=True)[1]
 
             correct_target += pred_target.eq(
-                target.view_as(pred_target)).sum().item()
+                target.view_as(pred_target)).sum()
 
     # Get overall accuracy
-    target_acc = 100. * correct_target / len(data_loader.dataset)
+    target_acc = 100. * float(correct_target) / len(data_loader.dataset)
 
     print('\tDrug Target Family Classification Accuracy: %5.2f%%' % target_acc)
 
@@ -13,6 +13,8 @@ import torch.nn as nn
 import torch.nn.functional as F
 from sklearn.metrics import r2_score
 
+from utils.miscellaneous.mixed_precision import MixedPrecision
+
 
 def train_resp(device: torch.device,
 
@@ -21,7 +23,8 @@ def train_resp(device: torch.device,
 
                max_num_batches: int,
                loss_func: callable,
-               optimizer: torch.optim, ):
+               optimizer: torch.optim,
+               amp: MixedPrecision, ):
 
     resp_net.train()
     total_loss = 0.
@@ -34,26 +37,32 @@ def train_resp(device: torch.device,
             break
 
         rnaseq, drug_feature, conc, grth = \
-            rnaseq.to(device), drug_feature.to(device), \
-            conc.to(device), grth.to(device)
+            rnaseq.to(device, non_blocking=True), \
+            drug_feature.to(device, non_blocking=True), \
+            conc.to(device, non_blocking=True), \
+            grth.to(device, non_blocking=True)
         resp_net.zero_grad()
 
-        pred_growth = resp_net(rnaseq, drug_feature, conc)
-        loss = loss_func(pred_growth, grth)
-        loss.backward()
-        optimizer.step()
+        with amp.autocast():
+            pred_growth = resp_net(rnaseq, drug_feature, conc)
+            loss = loss_func(pred_growth, grth)
+        amp.backward(loss)
+        amp.step(optimizer)
 
         num_samples += conc.shape[0]
-        total_loss += loss.item() * conc.shape[0]
+        # Accumulate on device to avoid a GPU-CPU sync for every batch
+        total_loss += loss.detach().double() * conc.shape[0]
 
     print('\tDrug Response Regression Loss: %8.2f'
-          % (total_loss / num_samples))
+          % (float(total_loss) / num_samples))
 
 
 def valid_resp(device: torch.device,
 
                resp_net: nn.Module,
-               data_loaders: torch.utils.data.DataLoader, ):
+               data_loaders: torch.utils.data.DataLoader,
+               amp: MixedPrecision,
+               dtype: torch.dtype = torch.float32, ):
 
     resp_net.eval()
 
@@ -71,9 +80,13 @@ def valid_resp(device: torch.device,
 
             for rnaseq, drug_feature, conc, grth in val_loader:
                 rnaseq, drug_feature, conc, grth = \
-                    rnaseq.to(device), drug_feature.to(device), \
-                    conc.to(device), grth.to(device)
-                pred_growth = resp_net(rnaseq, drug_feature, conc)
+                    rnaseq.to(device, dtype, non_blocking=True), \
+                    drug_feature.to(device, dtype, non_blocking=True), \
+                    conc.to(device, dtype, non_blocking=True), \
+                    grth.to(device, non_blocking=True)
+                with amp.autocast(dtype):
+                    pred_growth = resp_net(rnaseq, drug_feature, conc)
+                pred_growth = pred_growth.float()
 
                 num_samples = conc.shape[0]
                 mse += F.mse_loss(pred_growth, grth).item() * num_samples
@@ -175,7 +175,8 @@ def get_encoder(
     optimizer = get_optimizer(opt_type=ae_opt,
                               networks=autoencoder,
                               learning_rate=ae_lr,
-                              l2_regularization=ae_reg)
+                              l2_regularization=ae_reg,
+                              fused=(device == torch.device('cuda')))
     lr_decay = LambdaLR(optimizer, lr_lambda=lambda e: lr_decay_factor ** e)
 
     # Train until max number of epochs is reached or early stopped ############
@@ -195,7 +196,7 @@ def get_encoder(
         autoencoder.train()
         trn_loss = 0.
         for batch_idx, samples in enumerate(trn_dataloader):
-            samples = samples.to(device)
+            samples = samples.to(device, non_blocking=True)
             recon_samples = autoencoder(samples)
             autoencoder.zero_grad()
 
@@ -203,20 +204,20 @@ def get_encoder(
             loss.backward()
             optimizer.step()
 
-            trn_loss += loss.item() * len(samples)
-        trn_loss /= len(trn_dataloader.dataset)
+            trn_loss += loss.detach().double() * len(samples)
+        trn_loss = float(trn_loss) / len(trn_dataloader.dataset)
 
         # Validation loop for autoencoder
         autoencoder.eval()
         val_loss = 0.
         with torch.no_grad():
             for samples in val_dataloader:
-                samples = samples.to(device)
+                samples = samples.to(device, non_blocking=True)
                 recon_samples = autoencoder(samples)
                 loss = loss_func(input=recon_samples, target=samples)
 
-                val_loss += loss.item() * len(samples)
-            val_loss /= len(val_dataloader.dataset)
+                val_loss += loss.double() * len(samples)
+            val_loss = float(val_loss) / len(val_dataloader.dataset)
 
         if verbose:
             print('Epoch %4i: training loss: %.4f;\t validation loss: %.4f'
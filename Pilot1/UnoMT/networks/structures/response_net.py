@@ -7,8 +7,11 @@
     File Description:
 
 """
+import inspect
+
 import torch
 import torch.nn as nn
+import torch.utils.checkpoint
 from networks.structures.residual_block import ResBlock
 from networks.initialization.weight_init import basic_weight_init
 
@@ -29,13 +32,39 @@ class RespNet(nn.Module):
                  resp_num_layers: int,
 
                  resp_dropout: float,
-                 resp_activation: str):
+                 resp_activation: str,
+
+                 grad_checkpointing: bool = False):
 
         super(RespNet, self).__init__()
 
         self.__gene_encoder = gene_encoder
         self.__drug_encoder = drug_encoder
 
+        # Recompute the activations of residual blocks during backward
+        # propagation instead of storing them, which trades some compute
+        # for memory (and therefore allows larger batch sizes)
+        self.__checkpoint_kwargs = {}
+        checkpoint_params = \
+            inspect.signature(torch.utils.checkpoint.checkpoint).parameters
+        if 'use_reentrant' in checkpoint_params:
+            self.__checkpoint_kwargs['use_reentrant'] = False
+
+        # Residual blocks contain dropout, so the recomputation must draw the
+        # same dropout masks as the forward pass (i.e. the RNG state must be
+        # restored), which older PyTorch versions do not do. Note that
+        # preserve_rng_state is taken from **kwargs in most versions, while
+        # the versions without it only accept (function, *args)
+        preserves_rng_state = \
+            'preserve_rng_state' in checkpoint_params or \
+            any(p.kind == inspect.Parameter.VAR_KEYWORD
+                for p in checkpoint_params.values())
+        if grad_checkpointing and not preserves_rng_state:
+            print('Gradient checkpointing requires PyTorch 1.1 or newer. '
+                  'Residual blocks will not be checkpointed.')
+            grad_checkpointing = False
+        self.__grad_checkpointing = grad_checkpointing
+
         # Layer construction ##################################################
         # Network for response prediction
         self.__resp_net = nn.Sequential()
@@ -81,6 +110,18 @@ class RespNet(nn.Module):
         self.__resp_net.apply(basic_weight_init)
 
     def forward(self, rnaseq, drug_feature, concentration):
-        return self.__resp_net(torch.cat((self.__gene_encoder(rnaseq),
-                                          self.__drug_encoder(drug_feature),
-                                          concentration), dim=1))
+        x = torch.cat((self.__gene_encoder(rnaseq),
+                       self.__drug_encoder(drug_feature),
+                       concentration), dim=1)
+
+        if not (self.__grad_checkpointing and self.training and
+                torch.is_grad_enabled()):
+            return self.__resp_net(x)
+
+        for module in self.__resp_net:
+            if isinstance(module, ResBlock):
+                x = torch.utils.checkpoint.checkpoint(
+                    module, x, **self.__checkpoint_kwargs)
+            else:
+                x = module(x)
+        return x
@@ -231,7 +231,23 @@ additional_definitions = [
     {'name': 'no_cuda',
         'type': candle.str2bool,
         'default': False,
-        'help': 'disables CUDA training'}
+        'help': 'disables CUDA training'},
+    {'name': 'mixed_precision',
+        'type': candle.str2bool,
+        'default': False,
+        'help': 'enables automatic mixed precision (BF16 if supported, otherwise FP16) training on CUDA'},
+    {'name': 'torch_compile',
+        'type': candle.str2bool,
+        'default': False,
+        'help': 'compiles the networks with torch.compile for kernel fusion'},
+    {'name': 'fp16_validation',
+        'type': candle.str2bool,
+        'default': False,
+        'help': 'runs validation with the networks cast to FP16 on CUDA'},
+    {'name': 'grad_checkpointing',
+        'type': candle.str2bool,
+        'default': False,
+        'help': 'recomputes residual block activations of the drug response network during backward propagation to save memory'}
 ]
 
 required = [
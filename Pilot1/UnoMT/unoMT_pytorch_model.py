@@ -10,6 +10,7 @@
 
 """
 
+import inspect
 import time
 
 import numpy as np
@@ -33,12 +34,16 @@ from utils.datasets.cl_class_dataset import CLClassDataset
 from networks.initialization.encoder_init import get_gene_encoder, \
     get_drug_encoder
 from utils.datasets.drug_target_dataset import DrugTargetDataset
+from utils.miscellaneous.mixed_precision import MixedPrecision, \
+    cast_networks
 from utils.miscellaneous.optimizer import get_optimizer
 
 
 # Number of workers for dataloader. Too many workers might lead to process
 # hanging for PyTorch version 4.1. Set this number between 0 and 4.
 NUM_WORKER = 4
+# Number of batches loaded in advance by each worker (PyTorch 1.7+ only)
+PREFETCH_FACTOR = 4
 DATA_ROOT = '../../Data/Pilot1/'
 
 
@@ -66,6 +71,17 @@ class UnoMTModel(object):
             'num_workers': NUM_WORKER if self.use_cuda else 0,
             'pin_memory': True if self.use_cuda else False, }
 
+        # Keep the workers of training loaders alive across epochs and let
+        # them stage batches ahead of the training loop, if supported by the
+        # installed PyTorch. Validation loaders (one per validation source)
+        # still start their workers on demand, so that they do not stay alive
+        # (with their own copies of the datasets) for the whole run
+        self.trn_dataloader_kwargs = dict(self.dataloader_kwargs)
+        if self.dataloader_kwargs['num_workers'] > 0 and 'persistent_workers' \
+                in inspect.signature(torch.utils.data.DataLoader).parameters:
+            self.trn_dataloader_kwargs['prefetch_factor'] = PREFETCH_FACTOR
+            self.trn_dataloader_kwargs['persistent_workers'] = True
+
         # Drug response dataloaders for training/validation
         self.drug_resp_dataset_kwargs = {
             'data_root': DATA_ROOT,
@@ -144,7 +160,7 @@ class UnoMTModel(object):
                             training=True,
                             **(self.drug_resp_dataset_kwargs)),
             batch_size=args.trn_batch_size,
-            **(self.dataloader_kwargs))
+            **(self.trn_dataloader_kwargs))
 
         # List of data loaders for different validation sets
         self.drug_resp_val_loaders = [torch.utils.data.DataLoader(
@@ -158,7 +174,7 @@ class UnoMTModel(object):
             CLClassDataset(training=True,
                            **(self.cl_clf_dataset_kwargs)),
             batch_size=args.trn_batch_size,
-            **(self.dataloader_kwargs))
+            **(self.trn_dataloader_kwargs))
 
         self.cl_clf_val_loader = torch.utils.data.DataLoader(
             CLClassDataset(training=False,
@@ -170,7 +186,7 @@ class UnoMTModel(object):
             DrugTargetDataset(training=True,
                               **(self.drug_target_dataset_kwargs)),
             batch_size=args.trn_batch_size,
-            **(self.dataloader_kwargs))
+            **(self.trn_dataloader_kwargs))
 
         self.drug_target_val_loader = torch.utils.data.DataLoader(
             DrugTargetDataset(training=False,
@@ -182,7 +198,7 @@ class UnoMTModel(object):
             DrugQEDDataset(training=True,
                            **(self.drug_qed_dataset_kwargs)),
             batch_size=args.trn_batch_size,
-            **(self.dataloader_kwargs))
+            **(self.trn_dataloader_kwargs))
 
         self.drug_qed_val_loader = torch.utils.data.DataLoader(
             DrugQEDDataset(training=False,
@@ -252,7 +268,9 @@ class UnoMTModel(object):
             resp_num_layers=args.resp_num_layers,
             resp_dropout=args.dropout,
 
-            resp_activation=args.resp_activation).to(device)
+            resp_activation=args.resp_activation,
+
+            grad_checkpointing=args.grad_checkpointing).to(device)
 
         print(self.resp_net)
 
@@ -293,6 +311,32 @@ class UnoMTModel(object):
             num_layers=args.drug_qed_num_layers,
             activation=args.drug_qed_activation).to(device)
 
+        # Kernel fusion with TorchDynamo/Inductor (PyTorch 2.0+ only)
+        if args.torch_compile:
+            if args.multi_gpu:
+                print('torch.compile does not support nn.DataParallel. '
+                      'Networks will not be compiled.')
+            elif hasattr(torch, 'compile'):
+                import torch._dynamo
+                # Each network is compiled separately and the last batch of
+                # every epoch might have a different size
+                torch._dynamo.config.cache_size_limit = 64
+                compile_kwargs = {'mode': 'max-autotune'}
+                self.resp_net = torch.compile(self.resp_net, **compile_kwargs)
+                self.category_clf_net = \
+                    torch.compile(self.category_clf_net, **compile_kwargs)
+                self.site_clf_net = \
+                    torch.compile(self.site_clf_net, **compile_kwargs)
+                self.type_clf_net = \
+                    torch.compile(self.type_clf_net, **compile_kwargs)
+                self.drug_target_net = \
+                    torch.compile(self.drug_target_net, **compile_kwargs)
+                self.drug_qed_net = \
+                    torch.compile(self.drug_qed_net, **compile_kwargs)
+            else:
+                print('torch.compile requires PyTorch 2.0 or newer. '
+                      'Networks will not be compiled.')
+
         # Multi-GPU settings
         if args.multi_gpu:
             self.resp_net = nn.DataParallel(self.resp_net)
@@ -327,6 +371,13 @@ class UnoMTModel(object):
         self.drug_qed_loss_func = F.l1_loss if args.drug_qed_loss_func == 'l1' \
             else F.mse_loss
 
+        # Mixed precision (autocast + loss scaling) for each of the tasks
+        use_amp = args.mixed_precision and self.use_cuda
+        self.resp_amp = MixedPrecision(enabled=use_amp)
+        self.cl_clf_amp = MixedPrecision(enabled=use_amp)
+        self.drug_target_amp = MixedPrecision(enabled=use_amp)
+        self.drug_qed_amp = MixedPrecision(enabled=use_amp)
+
     def update_l2regularizer(self, reg):
 
         args = self.args
@@ -334,24 +385,28 @@ class UnoMTModel(object):
         self.resp_opt = get_optimizer(opt_type=args.resp_opt,
                                       networks=self.resp_net,
                                       learning_rate=args.resp_lr,
-                                      l2_regularization=reg)
+                                      l2_regularization=reg,
+                                      fused=self.use_cuda)
 
         self.cl_clf_opt = get_optimizer(opt_type=args.cl_clf_opt,
                                         networks=[self.category_clf_net,
                                                   self.site_clf_net,
                                                   self.type_clf_net],
                                         learning_rate=self.args.cl_clf_lr,
-                                        l2_regularization=reg)
+                                        l2_regularization=reg,
+                                        fused=self.use_cuda)
 
         self.drug_target_opt = get_optimizer(opt_type=args.drug_target_opt,
                                              networks=self.drug_target_net,
                                              learning_rate=args.drug_target_lr,
-                                             l2_regularization=reg)
+                                             l2_regularization=reg,
+                                             fused=self.use_cuda)
 
         self.drug_qed_opt = get_optimizer(opt_type=args.drug_qed_opt,
                                           networks=self.drug_qed_net,
                                           learning_rate=args.drug_qed_lr,
-                                          l2_regularization=reg)
+                                          l2_regularization=reg,
+                                          fused=self.use_cuda)
 
     def update_dropout(self, dropout_rate):
 
@@ -372,7 +427,9 @@ class UnoMTModel(object):
             resp_dropout=self.args.dropout,
 
 
-            resp_activation=self.args.resp_activation).to(self.device)
+            resp_activation=self.args.resp_activation,
+
+            grad_checkpointing=self.args.grad_checkpointing).to(self.device)
 
     def pre_train_config(self):
 
@@ -423,14 +480,16 @@ class UnoMTModel(object):
                          type_clf_net=self.type_clf_net,
                          data_loader=self.cl_clf_trn_loader,
                          max_num_batches=args.max_num_batches,
-                         optimizer=self.cl_clf_opt)
+                         optimizer=self.cl_clf_opt,
+                         amp=self.cl_clf_amp)
 
             # Training drug target classifier
             train_drug_target(device=device,
                               drug_target_net=self.drug_target_net,
                               data_loader=self.drug_target_trn_loader,
                               max_num_batches=args.max_num_batches,
-                              optimizer=self.drug_target_opt)
+                              optimizer=self.drug_target_opt,
+                              amp=self.drug_target_amp)
 
             # Training drug weighted QED regressor
             train_drug_qed(device=device,
@@ -438,7 +497,8 @@ class UnoMTModel(object):
                            data_loader=self.drug_qed_trn_loader,
                            max_num_batches=args.max_num_batches,
                            loss_func=self.drug_qed_loss_func,
-                           optimizer=self.drug_qed_opt)
+                           optimizer=self.drug_qed_opt,
+                           amp=self.drug_qed_amp)
 
             # Training drug response regressor
             train_resp(device=device,
@@ -446,7 +506,8 @@ class UnoMTModel(object):
                        data_loader=self.drug_resp_trn_loader,
                        max_num_batches=args.max_num_batches,
                        loss_func=self.resp_loss_func,
-                       optimizer=self.resp_opt)
+                       optimizer=self.resp_opt,
+                       amp=self.resp_amp)
 
             if epoch >= args.resp_val_start_epoch:
 
@@ -469,46 +530,70 @@ class UnoMTModel(object):
 
     def validation(self, epoch):
 
-        # args = self.args
+        args = self.args
         device = self.device
 
-        # Validating cell line classifier
-        cl_category_acc, cl_site_acc, cl_type_acc = \
-            valid_cl_clf(device=device,
-                         category_clf_net=self.category_clf_net,
-                         site_clf_net=self.site_clf_net,
-                         type_clf_net=self.type_clf_net,
-                         data_loader=self.cl_clf_val_loader, )
-
-        self.val_cl_clf_acc.append([cl_category_acc, cl_site_acc, cl_type_acc])
-
-        # Validating drug target classifier
-        drug_target_acc = \
-            valid_drug_target(device=device,
-                              drug_target_net=self.drug_target_net,
-                              data_loader=self.drug_target_val_loader)
-        self.val_drug_target_acc.append(drug_target_acc)
-
-        # Validating drug weighted QED regressor
-        drug_qed_mse, drug_qed_mae, drug_qed_r2 = \
-            valid_drug_qed(device=device,
-                           drug_qed_net=self.drug_qed_net,
-                           data_loader=self.drug_qed_val_loader)
-
-        self.val_drug_qed_mse.append(drug_qed_mse)
-        self.val_drug_qed_mae.append(drug_qed_mae)
-        self.val_drug_qed_r2.append(drug_qed_r2)
-
-        # Validating drug response regressor
-        resp_mse, resp_mae, resp_r2 = \
-            valid_resp(device=device,
-                       resp_net=self.resp_net,
-                       data_loaders=self.drug_resp_val_loaders)
-
-        # Save the validation results in nested list
-        self.val_resp_mse.append(resp_mse)
-        self.val_resp_mae.append(resp_mae)
-        self.val_resp_r2.append(resp_r2)
+        # Validate with the networks statically cast to FP16, which saves
+        # the per-operation dtype dispatch of autocast for inference
+        if args.fp16_validation and self.use_cuda:
+            val_dtype = torch.float16
+        else:
+            val_dtype = torch.float32
+
+        networks = [self.resp_net,
+                    self.category_clf_net,
+                    self.site_clf_net,
+                    self.type_clf_net,
+                    self.drug_target_net,
+                    self.drug_qed_net, ]
+
+        with cast_networks(networks, val_dtype):
+            # Validating cell line classifier
+            cl_category_acc, cl_site_acc, cl_type_acc = \
+                valid_cl_clf(device=device,
+                             category_clf_net=self.category_clf_net,
+                             site_clf_net=self.site_clf_net,
+                             type_clf_net=self.type_clf_net,
+                             data_loader=self.cl_clf_val_loader,
+                             amp=self.cl_clf_amp,
+                             dtype=val_dtype, )
+
+            self.val_cl_clf_acc.append(
+                [cl_category_acc, cl_site_acc, cl_type_acc])
+
+            # Validating drug target classifier
+            drug_target_acc = \
+                valid_drug_target(device=device,
+                                  drug_target_net=self.drug_target_net,
+                                  data_loader=self.drug_target_val_loader,
+                                  amp=self.drug_target_amp,
+                                  dtype=val_dtype)
+            self.val_drug_target_acc.append(drug_target_acc)
+
+            # Validating drug weighted QED regressor
+            drug_qed_mse, drug_qed_mae, drug_qed_r2 = \
+                valid_drug_qed(device=device,
+                               drug_qed_net=self.drug_qed_net,
+                               data_loader=self.drug_qed_val_loader,
+                               amp=self.drug_qed_amp,
+                               dtype=val_dtype)
+
+            self.val_drug_qed_mse.append(drug_qed_mse)
+            self.val_drug_qed_mae.append(drug_qed_mae)
+            self.val_drug_qed_r2.append(drug_qed_r2)
+
+            # Validating drug response regressor
+            resp_mse, resp_mae, resp_r2 = \
+                valid_resp(device=device,
+                           resp_net=self.resp_net,
+                           data_loaders=self.drug_resp_val_loaders,
+                           amp=self.resp_amp,
+                           dtype=val_dtype)
+
+            # Save the validation results in nested list
+            self.val_resp_mse.append(resp_mse)
+            self.val_resp_mae.append(resp_mae)
+            self.val_resp_r2.append(resp_r2)
 
         return resp_r2
 
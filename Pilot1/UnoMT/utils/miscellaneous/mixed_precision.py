@@ -0,0 +1,152 @@
+"""
+    File Name:          UnoPytorch/mixed_precision.py
+    File Description:   Helpers for automatic mixed precision (AMP)
+                        training and validation on CUDA devices.
+"""
+import contextlib
+import inspect
+import itertools
+
+import torch
+
+
+class MixedPrecision(object):
+    """This class wraps autocast and gradient scaling for a single task.
+
+    When enabled, the forward passes are executed under CUDA autocast, so
+    that matrix multiplications run in reduced precision on tensor cores.
+    BF16 is used if the device supports it (Ampere or newer). It has the
+    same exponent range as FP32, so no loss scaling is needed. Otherwise
+    FP16 is used, and the losses are scaled with a GradScaler to prevent
+    gradient underflow.
+
+    When disabled (or not supported by the installed PyTorch), all the
+    methods fall back to plain FP32 behavior, so that the training loops
+    could use the same code path regardless of the setting.
+
+    Note that each task (optimizer) should have its own instance, because
+    the loss scale is tracked separately for losses of different magnitude.
+    """
+
+    def __init__(self, enabled: bool):
+        """amp = MixedPrecision(enabled=True)
+
+        Args:
+            enabled (bool): indicator of mixed precision usage.
+        """
+
+        if enabled and not hasattr(torch.cuda, 'amp'):
+            print('Mixed precision requires PyTorch 1.6 or newer. '
+                  'Falling back to FP32 ...')
+            enabled = False
+
+        self.enabled = enabled
+        self.dtype = torch.float32
+        self.scaler = None
+
+        if enabled:
+            if _is_bf16_supported():
+                self.dtype = torch.bfloat16
+            else:
+                self.dtype = torch.float16
+                self.scaler = torch.cuda.amp.GradScaler()
+
+    def autocast(self, dtype: torch.dtype = torch.float32):
+        """with amp.autocast(): ...
+
+        Args:
+            dtype (torch.dtype): dtype of the networks and inputs. Networks
+                already cast to a low precision dtype (see cast_networks) run
+                without autocast.
+
+        Returns:
+            context manager for the forward pass (and loss computation).
+        """
+        if dtype != torch.float32:
+            return contextlib.suppress()
+        if self.dtype == torch.bfloat16:
+            return torch.cuda.amp.autocast(dtype=torch.bfloat16)
+        if self.enabled:
+            return torch.cuda.amp.autocast()
+        return contextlib.suppress()
+
+    def backward(self, loss: torch.Tensor):
+        """amp.backward(loss)
+
+        Back-propagates the (scaled if FP16) loss.
+
+        Args:
+            loss (torch.Tensor): loss to back-propagate.
+        """
+        if self.scaler is not None:
+            self.scaler.scale(loss).backward()
+        else:
+            loss.backward()
+
+    def step(self, optimizer: torch.optim.Optimizer):
+        """amp.step(optimizer)
+
+        Unscales the gradients (if FP16), performs the optimization step,
+        and updates the loss scale for the next iteration.
+
+        Args:
+            optimizer (torch.optim.Optimizer): optimizer to step.
+        """
+        if self.scaler is not None:
+            self.scaler.step(optimizer)
+            self.scaler.update()
+        else:
+            optimizer.step()
+
+
+def _is_bf16_supported():
+    """Returns True if the CUDA device natively supports BF16 (Ampere or
+    newer). Recent PyTorch versions also count the emulated BF16 on older
+    devices (e.g. V100), which is much slower than FP16 on tensor cores.
+    """
+    if not hasattr(torch.cuda, 'is_bf16_supported'):
+        return False
+    if 'including_emulation' in \
+            inspect.signature(torch.cuda.is_bf16_supported).parameters:
+        return torch.cuda.is_bf16_supported(including_emulation=False)
+    return torch.cuda.is_bf16_supported()
+
+
+@contextlib.contextmanager
+def cast_networks(networks: list, dtype: torch.dtype = torch.float32):
+    """with cast_networks([net0, net1], torch.float16): ...
+
+    This function casts the floating point parameters and buffers of the
+    given networks to dtype in place, and restores the original tensors
+    afterwards. Inside the context, the networks could run a pure low
+    precision forward pass (on inputs of the same dtype), which is cheaper
+    than autocast for inference.
+
+    Note that the original tensors are restored as they were, so there is
+    no precision loss for the FP32 master weights. The parameter objects
+    are kept, so the optimizers are not affected. Shared modules (such as
+    encoders) are only cast once.
+
+    Args:
+        networks (list): list of nn.Module to cast.
+        dtype (torch.dtype): dtype inside the context. Nothing is cast if
+            it is torch.float32.
+    """
+
+    if dtype == torch.float32:
+        yield
+        return
+
+    tensors = {}
+    for net in networks:
+        for t in itertools.chain(net.parameters(), net.buffers()):
+            if t.is_floating_point():
+                tensors[id(t)] = (t, t.data)
+
+    try:
+        for t, data in tensors.values():
+            t.data = data.to(dtype)
+        yield
+    finally:
+        for t, data in tensors.values():
+            t.data = data
@@ -8,6 +8,7 @@
 
 """
 import collections
+import inspect
 
 import torch.nn as nn
 from torch.optim import Adam, RMSprop, SGD
@@ -17,7 +18,8 @@ def get_optimizer(
         opt_type: str,
         networks: nn.Module or iter,
         learning_rate: float,
-        l2_regularization: float):
+        l2_regularization: float,
+        fused: bool = False):
 
     if isinstance(networks, collections.Iterable):
         params = []
@@ -29,18 +31,21 @@ def get_optimizer(
         params = networks.parameters()
 
     if opt_type.lower() == 'adam':
-        optimizer = Adam(params,
-                         lr=learning_rate,
-                         amsgrad=True,
-                         weight_decay=l2_regularization)
+        opt_class, opt_kwargs = Adam, {'amsgrad': True}
     elif opt_type.lower() == 'rmsprop':
-        optimizer = RMSprop(params,
-                            lr=learning_rate,
-                            weight_decay=l2_regularization)
+        opt_class, opt_kwargs = RMSprop, {}
     else:
-        optimizer = SGD(params,
-                        lr=learning_rate,
-                        momentum=0.9,
-                        weight_decay=l2_regularization)
+        opt_class, opt_kwargs = SGD, {'momentum': 0.9}
+
+    # Fused implementation updates all the (CUDA) parameters with a single
+    # multi-tensor kernel instead of several kernels per parameter.
+    # Only available for some optimizers in newer versions of PyTorch
+    if fused and 'fused' in inspect.signature(opt_class).parameters:
+        opt_kwargs['fused'] = True
+
+    optimizer = opt_class(params,
+                          lr=learning_rate,
+                          weight_decay=l2_regularization,
+                          **opt_kwargs)
 
     return optimizer
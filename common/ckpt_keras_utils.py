@@ -33,6 +33,21 @@ ckpt_checksum : boolean
     If True, compute a checksum for the model
     and store it in the JSON.
     Also, confirm checksum at restart time.
+    Uses the multi-threaded BLAKE3 tree hash if the blake3 package
+    is installed, else hardware-accelerated CRC32C if the
+    google-crc32c package is installed, else zlib CRC32.
+    The algorithm used is recorded in the JSON.
+    The checksum is computed from the model serialized in memory
+    (see Background I/O below), i.e. the same bytes that are
+    written to model.h5, instead of reading the file back.
+    At restart time, the checksum is only recomputed if the
+    size or modification time of model.h5 differ from the
+    ones recorded in the JSON (see ckpt_checksum_force).
+    Default: False
+
+ckpt_checksum_force : boolean
+    If True, always recompute the checksum at restart time,
+    even if the size and modification time of model.h5 match.
     Default: False
 
 ckpt_keep_mode : string
@@ -103,12 +118,28 @@ You may simply remove any of them.
 Normally you will not want to remove the one pointed to by ckpts/last,
 but if you do, restart() will simply start from scratch.
 
+Background I/O:
+
+Only model.save() runs on the training thread,
+into memory if the Keras version can save HDF5 to a file object
+(i.e. tf.keras 2.x; otherwise model.h5 is written directly
+and read back for the checksum, if enabled).
+Writing model.h5 from memory, the checksum, the JSON, renames, links,
+and cleanup of old checkpoints run on a background thread,
+overlapping with the next epoch.
+They are always completed before the next checkpoint is started
+and at the end of training (or in report_final()).
+model.h5 and the JSON are fsync()ed before ckpts/work is renamed,
+so a renamed checkpoint directory is always complete on disk.
+
 Logging:
 
 A log of ckpt operations is in ckpt_directory/ckpt.log
 
 """
 
+import concurrent.futures
+import io
 import json
 import os
 import shutil
@@ -120,6 +151,16 @@ from helper_utils import set_up_logger, str2bool
 from tensorflow.keras.models import Model
 from tensorflow.keras.callbacks import Callback, ModelCheckpoint
 
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
 
 class MultiGPUCheckpoint(ModelCheckpoint):
 
@@ -167,6 +208,14 @@ class CandleCheckpointCallback(Callback):
         self.epochs = []
         # The best epoch wrt metric.  Do not delete this!
         self.epoch_best = 0
+        # Single worker: checkpoint I/O is done in order, one at a time
+        self.io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # The checkpoint I/O that is currently running, if any
+        self.io_pending = None
+        # The serialized model (io.BytesIO) waiting to be written, if any
+        self.model_buffer = None
+        # Cleared if this Keras cannot save the model into memory
+        self.serialize_enabled = True
         self.report_initial()
 
     def report_initial(self):
@@ -227,9 +276,14 @@ class CandleCheckpointCallback(Callback):
         3. If best, link ckpts/best to ckpts/epoch/NNN
         4. Link ckpts/last to ckpts/epoch/NNN
         5. Clean up old ckpts according to keep policy
+        Steps 2-5 (and the checksum and JSON of step 1)
+        are done in the background: see persist()
         """
 
         epoch += 1
+        # The previous checkpoint must be complete before
+        # we touch ckpts/work or the keep policy state again
+        self.wait()
 
         dir_root = PosixPath(self.ckpt_directory).resolve()
         dir_work = dir_root / "ckpts/work"
@@ -240,12 +294,27 @@ class CandleCheckpointCallback(Callback):
 
         if not self.save_check(logs, epoch):
             return
-        if os.path.exists(dir_this):
-            self.debug("remove:  '%s'" % self.relpath(dir_this))
-            shutil.rmtree(dir_this)
         os.makedirs(dir_epochs, exist_ok=True)
         os.makedirs(dir_work, exist_ok=True)
         self.write_model(dir_work, epoch)
+        self.io_pending = self.io_pool.submit(self.persist,
+                                              dir_work, dir_this,
+                                              dir_best, dir_last, epoch)
+
+    def persist(self, dir_work, dir_this, dir_best, dir_last, epoch):
+        """
+        Finish the checkpoint written by write_model()
+        Runs on the background I/O thread
+        """
+        if self.model_buffer is not None:
+            self.write_model_buffer(dir_work)
+        self.checksum(dir_work)
+        self.model_buffer = None
+        self.write_json(dir_work / "ckpt-info.json", epoch)
+        fsync_file(dir_work / "model.h5")
+        if os.path.exists(dir_this):
+            self.debug("remove:  '%s'" % self.relpath(dir_this))
+            shutil.rmtree(dir_this)
         self.debug("rename:  '%s' -> '%s'" %
                    (self.relpath(dir_work), self.relpath(dir_this)))
         os.rename(dir_work, dir_this)
@@ -255,6 +324,17 @@ class CandleCheckpointCallback(Callback):
         self.symlink(dir_this, dir_last)
         self.clean(epoch)
 
+    def wait(self):
+        """
+        Block until the pending checkpoint I/O is complete
+        Re-raises any exception from the background thread
+        """
+        if self.io_pending is None:
+            return
+        pending = self.io_pending
+        self.io_pending = None
+        pending.result()
+
     def save_check(self, logs, epoch):
         """
         Make sure we want to save this epoch based on the
@@ -335,12 +415,72 @@ class CandleCheckpointCallback(Callback):
         """
         Do the I/O, report stats
         dir_work: A PosixPath
+        If possible, only serialize the model to memory:
+        write_model_buffer() writes it out in the background
         """
         model_file = dir_work / "model.h5"
+        if self.serialize_enabled:
+            if self.serialize_model(model_file):
+                return
         self.debug("writing model to: '%s'" % self.relpath(model_file))
         start = time.time()
+        self.save_model(model_file)
+        stop = time.time()
+        duration = stop - start
+        stats = os.stat(model_file)
+        MB = stats.st_size / (1024 * 1024)
+        rate = MB / duration
+        self.debug("model wrote: %0.3f MB in %0.3f seconds (%0.2f MB/s)." %
+                   (MB, duration, rate))
+
+    def save_model(self, target):
+        """
+        Save the model in HDF5 format
+        target: A PosixPath, or an open h5py.File
+        """
         # TODO: Implement save_weights_only
-        self.model.save(model_file)  # save_format="h5"
+        self.model.save(target)  # save_format="h5"
+
+    def serialize_model(self, model_file):
+        """
+        Save the model in HDF5 format into self.model_buffer
+        model_file: A PosixPath, for logging only
+        Returns False (and disables serialization for later epochs)
+        if the model cannot be saved into memory:
+        Keras 3 only accepts file paths in model.save()
+        """
+        self.debug("serializing model for: '%s'" % self.relpath(model_file))
+        start = time.time()
+        self.model_buffer = io.BytesIO()
+        try:
+            import h5py
+            with h5py.File(self.model_buffer, "w") as fp:
+                self.save_model(fp)
+        except (ImportError, TypeError, ValueError) as e:
+            self.info("cannot serialize model to memory (%s), "
+                      "writing model.h5 directly" % str(e))
+            self.model_buffer = None
+            self.serialize_enabled = False
+            return False
+        stop = time.time()
+        duration = stop - start
+        MB = self.model_buffer.getbuffer().nbytes / (1024 * 1024)
+        rate = MB / duration
+        self.debug("model serialized: %0.3f MB in %0.3f seconds "
+                   "(%0.2f MB/s)." % (MB, duration, rate))
+        return True
+
+    def write_model_buffer(self, dir_work):
+        """
+        Write self.model_buffer to model.h5, report stats
+        dir_work: A PosixPath
+        """
+        model_file = dir_work / "model.h5"
+        self.debug("writing model to: '%s'" % self.relpath(model_file))
+        start = time.time()
+        with open(model_file, "wb") as fp:
+            with self.model_buffer.getbuffer() as view:
+                fp.write(view)
         stop = time.time()
         duration = stop - start
         stats = os.stat(model_file)
@@ -348,18 +488,26 @@ class CandleCheckpointCallback(Callback):
         rate = MB / duration
         self.debug("model wrote: %0.3f MB in %0.3f seconds (%0.2f MB/s)." %
                    (MB, duration, rate))
-        self.checksum(dir_work)
-        self.write_json(dir_work / "ckpt-info.json", epoch)
 
     def checksum(self, dir_work):
         """
         Simple checksum dispatch
+        Uses self.model_buffer if available,
+        else reads model.h5 back
         dir_work: A PosixPath
         """
         if self.checksum_enabled:
-            self.cksum_model = checksum_file(self.logger,
-                                             dir_work / "model.h5")
+            self.cksum_algorithm = checksum_algorithm()
+            if self.model_buffer is not None:
+                with self.model_buffer.getbuffer() as view:
+                    self.cksum_model = checksum_buffer(self.logger, view,
+                                                       self.cksum_algorithm)
+            else:
+                self.cksum_model = checksum_file(self.logger,
+                                                 dir_work / "model.h5",
+                                                 self.cksum_algorithm)
         else:
+            self.cksum_algorithm = None
             self.cksum_model = "__DISABLED__"
 
     def write_json(self, jsonfile, epoch):
@@ -371,6 +519,11 @@ class CandleCheckpointCallback(Callback):
         D["best_metric_last"] = self.best_metric_last
         D["model_file"] = "model.h5"
         D["checksum"] = self.cksum_model
+        D["checksum_algorithm"] = self.cksum_algorithm
+        # Allows restart to skip the checksum if the file is unchanged
+        stats = os.stat(jsonfile.parent / "model.h5")
+        D["model_size"] = stats.st_size
+        D["model_mtime_ns"] = stats.st_mtime_ns
         D["timestamp"] = now.strftime("%Y-%m-%d %H:%M:%S")
         if self.timestamp_last is None:
             time_elapsed = "__FIRST__"
@@ -382,6 +535,8 @@ class CandleCheckpointCallback(Callback):
         with open(jsonfile, "w") as fp:
             json.dump(D, fp)
             fp.write("\n")
+            fp.flush()
+            os.fsync(fp.fileno())
 
     def clean(self, epoch_now):
         """
@@ -433,12 +588,18 @@ class CandleCheckpointCallback(Callback):
         self.epochs.remove(epoch)
 
     def symlink(self, src, dst):
-        """ Like os.symlink, but overwrites dst and logs """
+        """
+        Like os.symlink, but overwrites dst and logs
+        The new link is created next to dst and renamed over it,
+        so dst always points to a complete checkpoint
+        """
         self.debug("linking: '%s' -> '%s'" %
                    (self.relpath(dst), self.relpath(src)))
-        if os.path.lexists(dst):
-            os.remove(dst)
-        os.symlink(src, dst)
+        tmp = dst.with_name(dst.name + ".new")
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+        os.symlink(src, tmp)
+        os.replace(tmp, dst)  # atomic on POSIX
 
     def relpath(self, p):
         return p.relative_to(self.cwd)
@@ -455,6 +616,7 @@ class CandleCheckpointCallback(Callback):
         self.report_final()
 
     def report_final(self):
+        self.wait()
         self.info("checkpoints kept: %i" %
                   len(self.epochs))
         self.info("checkpoints list: %s" %
@@ -521,9 +683,21 @@ def restart_json(gParameters, logger, directory):
     logger.debug("ckpt-info.json contains:")
     logger.debug(json.dumps(J, indent=2))
     if param(gParameters, "ckpt_checksum", False, ParamType.BOOLEAN):
-        checksum = checksum_file(logger, directory + "/model.h5")
+        model_file = directory + "/model.h5"
+        force = param(gParameters, "ckpt_checksum_force",
+                      False, ParamType.BOOLEAN)
+        stats = os.stat(model_file)
+        if not force and \
+           J.get("model_size") == stats.st_size and \
+           J.get("model_mtime_ns") == stats.st_mtime_ns:
+            logger.info("checksum skipped: model.h5 size and mtime "
+                        + "match ckpt-info.json")
+            return J
+        # JSON files written before the algorithm was recorded used CRC32
+        algorithm = J.get("checksum_algorithm") or "crc32"
+        checksum = checksum_file(logger, model_file, algorithm)
         if checksum != J["checksum"]:
-            raise Exception("checksum mismatch! directory: " %
+            raise Exception("checksum mismatch! directory: %s" %
                             directory)
 
     return J
@@ -643,20 +817,104 @@ def param_type_check_float(key, value, type_):
     return result
 
 
-def checksum_file(logger, filename):
-    """ Read file, compute checksum, return it as a string. """
+def checksum_algorithm():
+    """
+    The fastest checksum algorithm available:
+    "blake3", "crc32c", or "crc32"
+    """
+    if blake3 is not None:
+        return "blake3"
+    if google_crc32c is not None:
+        return "crc32c"
+    return "crc32"
+
+
+def fsync_file(filename):
+    """ Flush the contents of the given file to the disk """
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def checksum_require(algorithm):
+    """ Make sure the given checksum algorithm is known and available """
+    if algorithm == "blake3":
+        if blake3 is None:
+            raise Exception("checksum algorithm 'blake3' requires "
+                            + "the blake3 package!")
+    elif algorithm == "crc32c":
+        if google_crc32c is None:
+            raise Exception("checksum algorithm 'crc32c' requires "
+                            + "the google-crc32c package!")
+    elif algorithm != "crc32":
+        raise ValueError("checksum: unknown algorithm: '%s'" %
+                         algorithm)
+
+
+def checksum_buffer(logger, buffer, algorithm="crc32"):
+    """
+    Compute checksum of a bytes-like object, return it as a string.
+    Same result as checksum_file() on a file with the same contents.
+    """
     import zlib
+    checksum_require(algorithm)
     start = time.time()
-    chunk_size = 10 * 1024 * 1024
+    if algorithm == "blake3":
+        hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+        hasher.update(buffer)
+        checksum = hasher.hexdigest()
+    elif algorithm == "crc32c":
+        hasher = google_crc32c.Checksum()
+        hasher.update(buffer)
+        checksum = hasher.hexdigest().decode()
+    else:
+        checksum = str(zlib.crc32(buffer))
+    stop = time.time()
+    MB = len(buffer) / (1024 * 1024)
+    duration = stop - start
+    rate = MB / duration
+    logger.info("checksummed: %0.3f MB in %.3f seconds (%.2f MB/s)." %
+                (MB, duration, rate))
+    return checksum
+
+
+def checksum_file(logger, filename, algorithm="crc32"):
+    """
+    Read file, compute checksum, return it as a string.
+    algorithm: "crc32" (zlib),
+               "crc32c" (google-crc32c, uses the SSE4.2/ARMv8
+               CRC32C instructions when available), or
+               "blake3" (blake3, hashes blocks of a memory map
+               on all cores and combines them as a tree)
+    """
+    import zlib
+    checksum_require(algorithm)
+    if algorithm == "blake3":
+        return checksum_file_blake3(logger, filename)
+    if algorithm == "crc32c":
+        hasher = google_crc32c.Checksum()
+    start = time.time()
+    # Read into a single reusable buffer to avoid allocating
+    # and copying a new bytes object for each chunk
+    chunk_size = 4 * 1024 * 1024
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
     total = 0
     with open(filename, "rb") as fp:
         checksum = 0
         while True:
-            chunk = fp.read(chunk_size)
-            if not chunk:
+            n = fp.readinto(buffer)
+            if not n:
                 break
-            total += len(chunk)
-            checksum = zlib.crc32(chunk, checksum)
+            total += n
+            if algorithm == "crc32c":
+                hasher.update(view[:n])
+            else:
+                checksum = zlib.crc32(view[:n], checksum)
+    if algorithm == "crc32c":
+        checksum = hasher.hexdigest().decode()
     stop = time.time()
     MB = total / (1024 * 1024)
     duration = stop - start
@@ -666,6 +924,21 @@ def checksum_file(logger, filename):
     return str(checksum)
 
 
+def checksum_file_blake3(logger, filename):
+    """ Memory-map file, compute BLAKE3 hash, return it as a string. """
+    start = time.time()
+    hasher = blake3.blake3(max_threads=blake3.blake3.AUTO)
+    hasher.update_mmap(str(filename))
+    checksum = hasher.hexdigest()
+    stop = time.time()
+    MB = os.path.getsize(filename) / (1024 * 1024)
+    duration = stop - start
+    rate = MB / duration
+    logger.info("checksummed: %0.3f MB in %.3f seconds (%.2f MB/s)." %
+                (MB, duration, rate))
+    return checksum
+
+
 def param_allowed(key, value, allowed):
     """
     Check that the value is in the list of allowed values
@@ -689,6 +962,10 @@ def ckpt_parser(parser):
     parser.add_argument("--ckpt_checksum", type=str2bool,
                         default=False,
                         help="Checksum the restart file after read+write")
+    parser.add_argument("--ckpt_checksum_force", type=str2bool,
+                        default=False,
+                        help="Checksum the restart file at restart time "
+                             + "even if its size and mtime are unchanged")
     parser.add_argument("--ckpt_skip_epochs", type=int,
                         default=0,
                         help="Number of epochs to skip before saving epochs")
@@ -732,6 +1009,10 @@ def ckpt_defs(defs):
         {'name': 'ckpt_checksum', 'type': str2bool,
             'default': False,
             'help': 'Checksum the restart file after read+write'},
+        {'name': 'ckpt_checksum_force', 'type': str2bool,
+            'default': False,
+            'help': 'Checksum the restart file at restart time '
+            + 'even if its size and mtime are unchanged'},
         {'name': 'ckpt_skip_epochs', 'type': int,
             'default': 0,
             'help': 'Number of epochs to skip before saving epochs'},